@@ -16,13 +16,22 @@ Server starts at http://localhost:5000
 """
 
 import os
+import re
+import threading
 from datetime import date, timedelta
 
-from flask import Flask, jsonify, request, send_from_directory
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from cachetools import TTLCache
+from flask import Flask, Response, jsonify, request, send_from_directory
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
 from flask_cors import CORS
-from sqlalchemy import func
+from sqlalchemy import func, select
 
-from models import Stock, DailyPrice, get_session, init_db
+from models import PRICES_DIR, Stock, DailyPrice, SessionLocal, get_engine, get_session, init_db
 
 # ---------------------------------------------------------------------------
 # App setup
@@ -30,9 +39,50 @@ from models import Stock, DailyPrice, get_session, init_db
 
 FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend")
 
+class OrjsonProvider(JSONProvider):
+    """
+    Flask JSON provider backed by orjson — 5-10x faster than stdlib json on
+    numeric payloads, and serializes datetime.date natively. dumps() returns
+    bytes, which Response accepts directly (no str round-trip).
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__, static_folder=FRONTEND_DIR, static_url_path="")
+app.json = OrjsonProvider(app)
 CORS(app)
 
+# Price JSON is highly compressible (repeating date prefixes, similar float
+# magnitudes) — brotli/gzip typically cuts the wire size ~7x.
+app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+app.config["COMPRESS_LEVEL"] = 4
+app.config["COMPRESS_MIN_SIZE"] = 1024
+Compress(app)
+
+# Dev-only: flag N+1 lazy-load patterns. No endpoint traverses
+# relationships today, but this catches regressions once e.g. a
+# Stock.prices relationship appears. Opt in with NPLUSONE=1.
+if os.getenv("NPLUSONE"):
+    import logging
+
+    import nplusone.ext.sqlalchemy  # noqa: F401  — patches SQLAlchemy to emit signals
+    from nplusone.ext.flask_sqlalchemy import NPlusOne
+
+    app.config["NPLUSONE_LOGGER"] = logging.getLogger("nplusone")
+    app.config["NPLUSONE_LOG_LEVEL"] = logging.WARN
+    NPlusOne(app)
+
+
+@app.teardown_appcontext
+def _remove_session(exc):
+    """Return the request's scoped session to the factory."""
+    SessionLocal.remove()
+
 
 # ---------------------------------------------------------------------------
 # Helper
@@ -45,6 +95,85 @@ def period_to_start_date(period: str) -> date:
     return today - timedelta(days=days)
 
 
+# Price data changes at most once per trading day, so serialized response
+# bodies are cached in-process and served without re-querying the DB or
+# re-encoding JSON. Keys: "stocks" for the full list, (ticker, period) for
+# prices.
+_response_cache = TTLCache(maxsize=1024, ttl=3600)
+_cache_lock = threading.Lock()
+
+
+def _cache_get(key):
+    with _cache_lock:
+        return _response_cache.get(key)
+
+
+def _cache_set(key, body):
+    with _cache_lock:
+        _response_cache[key] = body
+
+
+def _json_response(body):
+    return Response(body, mimetype="application/json")
+
+
+# Valid ticker shape — also guards the Parquet path lookup against
+# path traversal via the URL
+_TICKER_RE = re.compile(r"[A-Z0-9.\-]{1,10}")
+
+
+def _load_prices_parquet(ticker: str, start: date):
+    """
+    Read OHLCV for one ticker from its Parquet file (memory-mapped, columns
+    only, date-filtered) and return (serialized columnar JSON body, last
+    date in the body). Returns None when the file is missing or unreadable
+    so the caller can fall back to SQLite.
+    """
+    if not _TICKER_RE.fullmatch(ticker):
+        return None
+    path = os.path.join(PRICES_DIR, f"{ticker}.parquet")
+    if not os.path.exists(path):
+        return None
+    try:
+        table = pq.read_table(
+            path,
+            columns=["date", "open", "high", "low", "close", "volume"],
+            filters=[("date", ">=", start.isoformat())],
+            memory_map=True,
+        )
+    except Exception:
+        return None
+    if table.num_rows == 0:
+        return None
+    # The on-disk floats are float32; widened to float64 for JSON they grow
+    # noise digits (136.3000030517578). Round to 4 decimals so the payload
+    # stays compact and matches what the SQLite path emits.
+    columns = {}
+    for name, col in zip(table.column_names, table.columns):
+        if pa.types.is_floating(col.type):
+            col = pc.round(col.cast(pa.float64()), ndigits=4)
+        columns[name] = col.to_pylist()
+    return app.json.dumps(columns), columns["date"][-1]
+
+
+def _with_etag(resp, etag):
+    if etag:
+        resp.set_etag(etag, weak=True)
+        resp.headers["Cache-Control"] = "private, max-age=3600"
+    return resp
+
+
+def _fts_match_expr(q: str) -> str:
+    """
+    Turn a raw user query into an FTS5 MATCH expression with prefix
+    matching on ticker and name. Tokens are double-quoted so user input
+    can't inject FTS query syntax.
+    """
+    tokens = [t.replace('"', '""') for t in q.split()]
+    prefix = " ".join(f'"{t}"*' for t in tokens)
+    return f"ticker:({prefix}) OR name:({prefix})"
+
+
 # ---------------------------------------------------------------------------
 # Routes — serve frontend
 # ---------------------------------------------------------------------------
@@ -61,12 +190,16 @@ def index():
 @app.route("/api/stocks", methods=["GET"])
 def list_stocks():
     """Return all S&P 500 stocks for the autocomplete dropdown."""
-    session = get_session()
-    try:
-        stocks = session.query(Stock).order_by(Stock.ticker).all()
-        return jsonify([{"ticker": s.ticker, "name": s.name} for s in stocks])
-    finally:
-        session.close()
+    body = _cache_get("stocks")
+    if body is None:
+        session = get_session()
+        try:
+            stocks = session.query(Stock).order_by(Stock.ticker).all()
+            body = app.json.dumps([{"ticker": s.ticker, "name": s.name} for s in stocks])
+        finally:
+            session.close()
+        _cache_set("stocks", body)
+    return _json_response(body)
 
 
 @app.route("/api/stocks/search", methods=["GET"])
@@ -80,26 +213,18 @@ def search_stocks():
     if not q:
         return jsonify([])
 
-    session = get_session()
-    try:
-        q_lower = q.lower()
-        results = (
-            session.query(Stock)
-            .filter(
-                (func.upper(Stock.ticker).like(f"{q}%"))
-                | (func.lower(Stock.name).like(f"%{q_lower}%"))
-            )
-            .order_by(
-                # Exact ticker match first
-                (func.upper(Stock.ticker) == q).desc(),
-                Stock.ticker,
-            )
-            .limit(20)
-            .all()
-        )
-        return jsonify([{"ticker": s.ticker, "name": s.name, "sector": s.sector} for s in results])
-    finally:
-        session.close()
+    with get_engine().connect() as conn:
+        rows = conn.exec_driver_sql(
+            "SELECT ticker, name, sector FROM stocks_fts "
+            "WHERE stocks_fts MATCH ? ORDER BY rank LIMIT 20",
+            (_fts_match_expr(q),),
+        ).all()
+    # BM25 rank, but an exact ticker match always goes first
+    rows = sorted(rows, key=lambda r: r[0].upper() != q)
+    return jsonify([
+        {"ticker": ticker, "name": name, "sector": sector}
+        for ticker, name, sector in rows
+    ])
 
 
 @app.route("/api/stocks/<ticker>", methods=["GET"])
@@ -122,25 +247,62 @@ def get_prices(ticker: str):
     Query param: period  (1y | 2y | 5y, default 1y)
     """
     period = request.args.get("period", "1y")
-    start = period_to_start_date(period)
+    ticker = ticker.upper()
 
-    session = get_session()
-    try:
-        prices = (
-            session.query(DailyPrice)
-            .filter(
-                DailyPrice.ticker == ticker.upper(),
-                DailyPrice.date >= start,
+    # Conditional GET: the ETag is derived from the newest date in the body
+    # being served and cached alongside it, so the validator always describes
+    # those exact bytes — even if SQLite has since received fresher data than
+    # the cached body or a not-yet-re-exported Parquet file.
+    cache_key = (ticker, period)
+    cached = _cache_get(cache_key)
+    if cached is None:
+        start = period_to_start_date(period)
+
+        # Columnar Parquet read first — an mmap'd slice of exactly the
+        # columns and date range needed, no row reassembly.
+        result = _load_prices_parquet(ticker, start)
+        if result is not None:
+            body, last_date = result
+            cached = (body, f"{ticker}:{last_date}:{period}")
+        else:
+            # Fallback: Core select returning plain row tuples — skips
+            # hydrating ~1250 DailyPrice ORM objects per request.
+            stmt = (
+                select(
+                    DailyPrice.date,
+                    DailyPrice.open,
+                    DailyPrice.high,
+                    DailyPrice.low,
+                    DailyPrice.close,
+                    DailyPrice.volume,
+                )
+                .where(DailyPrice.ticker == ticker, DailyPrice.date >= start)
+                .order_by(DailyPrice.date)
             )
-            .order_by(DailyPrice.date)
-            .all()
-        )
-        if not prices:
-            return jsonify({"error": f"No price data found for '{ticker}'"}), 404
+            with get_engine().connect() as conn:
+                rows = conn.execute(stmt).all()
+            if not rows:
+                return jsonify({"error": f"No price data found for '{ticker}'"}), 404
 
-        return jsonify([p.to_dict() for p in prices])
-    finally:
-        session.close()
+            # Columnar layout: one array per field instead of ~1250 row
+            # objects repeating the same 6 keys — ~4x smaller payload,
+            # cheaper to parse, and directly consumable by the chart
+            dates, opens, highs, lows, closes, volumes = zip(*rows)
+            body = app.json.dumps({
+                "date": dates,
+                "open": opens,
+                "high": highs,
+                "low": lows,
+                "close": closes,
+                "volume": volumes,
+            })
+            cached = (body, f"{ticker}:{dates[-1].isoformat()}:{period}")
+        _cache_set(cache_key, cached)
+
+    body, etag = cached
+    if request.if_none_match.contains_weak(etag):
+        return _with_etag(Response(status=304), etag)
+    return _with_etag(_json_response(body), etag)
 
 
 @app.route("/api/stats", methods=["GET"])
@@ -164,9 +326,16 @@ def stats():
 # Main
 # ---------------------------------------------------------------------------
 
+# Ensure DB exists at import so gunicorn workers are ready without a separate
+# bootstrap step (idempotent: tables/FTS created only if missing)
+init_db()
+
+
 if __name__ == "__main__":
-    # Ensure DB exists (tables created if missing)
-    init_db()
+    # Werkzeug dev server — single-process, for local development only.
+    # In production run a threaded worker pool so concurrent chart loads
+    # become parallel DB reads (WAL allows N readers + 1 writer):
+    #   gunicorn -w 4 -k gthread --threads 8 -b 0.0.0.0:5000 app:app
     print("\n S&P 500 Stock Analysis API")
     print(" Open http://localhost:5000 in your browser\n")
     app.run(debug=True, port=5000)
@@ -14,15 +14,36 @@ This takes ~5-15 minutes depending on network speed.
 It is safe to re-run -- existing records are skipped.
 """
 
+import argparse
 import io
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
 import requests
+import requests_cache
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import yfinance as yf
+from requests.adapters import HTTPAdapter
 from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+from models import PRICES_DIR, Stock, DailyPrice, get_engine, get_session, init_db
 
-from models import Stock, DailyPrice, get_engine, get_session, init_db
+# Cache HTTP responses (Wikipedia list, Yahoo price JSON) on disk for 6 hours.
+# install_cache patches requests.Session process-wide, so both our pooled
+# session and yfinance's internal requests benefit — re-runs within the window
+# skip the network entirely. Pass --refresh to start from a cleared cache.
+requests_cache.install_cache(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "stock_http_cache"),
+    backend="sqlite",
+    expire_after=timedelta(hours=6),
+)
 
 
 # ---------------------------------------------------------------------------
@@ -59,20 +80,33 @@ def get_sp500_list():
 # 2. Insert stocks into DB
 # ---------------------------------------------------------------------------
 
-def upsert_stocks(session, stocks):
+def upsert_stocks(engine, stocks):
     print(f"Inserting {len(stocks)} stocks into database...")
-    for s in stocks:
-        stmt = sqlite_insert(Stock).values(
-            ticker=s["ticker"],
-            name=s["name"],
-            sector=s.get("sector"),
-            industry=s.get("industry"),
-        ).on_conflict_do_update(
-            index_elements=["ticker"],
-            set_=dict(name=s["name"], sector=s.get("sector"), industry=s.get("industry")),
-        )
-        session.execute(stmt)
-    session.commit()
+    values = [
+        {
+            "ticker": s["ticker"],
+            "name": s["name"],
+            "sector": s.get("sector"),
+            "industry": s.get("industry"),
+        }
+        for s in stocks
+    ]
+    # SQLite has a 999-variable limit; 4 columns per row allows ~249 rows
+    # per INSERT. Use 200 to be safe.
+    INSERT_CHUNK = 200
+    with engine.begin() as conn:
+        for chunk_start in range(0, len(values), INSERT_CHUNK):
+            chunk = values[chunk_start: chunk_start + INSERT_CHUNK]
+            stmt = sqlite_insert(Stock).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["ticker"],
+                set_=dict(
+                    name=stmt.excluded.name,
+                    sector=stmt.excluded.sector,
+                    industry=stmt.excluded.industry,
+                ),
+            )
+            conn.execute(stmt)
     print("Stocks inserted.")
 
 
@@ -80,100 +114,307 @@ def upsert_stocks(session, stocks):
 # 3. Download 5 years of daily prices and insert into DB
 # ---------------------------------------------------------------------------
 
-BATCH_SIZE = 50  # Download N tickers at a time to avoid rate limits
-
-
-def _extract_ticker_rows(raw, ticker):
+BATCH_SIZE = 20  # Yahoo's spark endpoint accepts at most 20 comma-separated symbols per URL
+
+SPARK_URL = "https://query1.finance.yahoo.com/v8/finance/spark"
+
+MAX_WORKERS = 8  # Concurrent download threads (I/O-bound; requests releases the GIL)
+REQUESTS_PER_SECOND = 4  # Polite ceiling across all worker threads
+
+_rate_lock = threading.Lock()
+_next_request_at = 0.0
+
+
+def _throttle():
+    """Token-bucket style limiter: space HTTP requests out across workers."""
+    global _next_request_at
+    with _rate_lock:
+        now = time.monotonic()
+        wait = _next_request_at - now
+        _next_request_at = max(now, _next_request_at) + 1.0 / REQUESTS_PER_SECOND
+    if wait > 0:
+        time.sleep(wait)
+
+# Same browser User-Agent as the Wikipedia fetch — Yahoo also rejects the
+# default python-requests UA.
+_HTTP_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/124.0.0.0 Safari/537.36"
+    )
+}
+
+
+def _make_http_session():
+    """Build a requests.Session with connection pooling and retries."""
+    session = requests.Session()
+    session.headers.update(_HTTP_HEADERS)
+    retry = Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _download_batch_spark(http, batch):
     """
-    Extract OHLCV rows for a single ticker from a yfinance DataFrame.
-    Handles yfinance >= 1.0 MultiIndex columns: (Price, Ticker).
+    Download 5y daily OHLCV for up to 20 tickers in a single HTTP request
+    via Yahoo's spark endpoint, and parse the JSON straight into row dicts.
+
+    Prices are split/dividend-adjusted by scaling OHLC with adjclose/close,
+    matching the auto_adjust=True convention of the yfinance fallback.
+    Raises ValueError on degraded payloads (spark is a sparkline API and may
+    return close-only data) so the caller falls back to yfinance instead of
+    silently ingesting rows with NULL open/high/low/volume.
     """
+    resp = http.get(
+        SPARK_URL,
+        params={
+            "symbols": ",".join(batch),
+            "range": "5y",
+            "interval": "1d",
+        },
+        timeout=30,
+    )
+    resp.raise_for_status()
+    payload = resp.json()
+
     rows = []
-    try:
-        # yfinance 1.x always returns MultiIndex (Price, Ticker)
-        tickers_in_cols = raw.columns.get_level_values(1).unique().tolist()
-        if ticker not in tickers_in_cols:
-            return rows
-        df = raw.xs(ticker, axis=1, level=1).copy()
-    except (KeyError, AttributeError):
-        return rows
-
-    if df.empty:
-        return rows
-
-    df = df.reset_index()
-    date_col = "Date" if "Date" in df.columns else df.columns[0]
-
-    for _, row in df.iterrows():
-        close_val = row.get("Close")
-        if close_val is None or pd.isna(close_val):
+    for result in payload.get("spark", {}).get("result", []):
+        ticker = result.get("symbol")
+        responses = result.get("response") or []
+        if not ticker or not responses:
+            continue
+        chart = responses[0]
+        timestamps = chart.get("timestamp") or []
+        quote = (chart.get("indicators", {}).get("quote") or [{}])[0]
+        opens = quote.get("open") or []
+        highs = quote.get("high") or []
+        lows = quote.get("low") or []
+        closes = quote.get("close") or []
+        volumes = quote.get("volume") or []
+        adjcloses = (chart.get("indicators", {}).get("adjclose") or [{}])[0].get("adjclose") or []
+        if not timestamps or not closes:
             continue
-        date_val = row[date_col]
-        if hasattr(date_val, "date"):
-            date_val = date_val.date()
-        rows.append({
-            "ticker": ticker,
-            "date": date_val,
-            "open": float(row["Open"]) if not pd.isna(row.get("Open")) else None,
-            "high": float(row["High"]) if not pd.isna(row.get("High")) else None,
-            "low": float(row["Low"]) if not pd.isna(row.get("Low")) else None,
-            "close": float(close_val),
-            "volume": int(row["Volume"]) if not pd.isna(row.get("Volume")) else None,
-        })
+        if not (opens and highs and lows and volumes and adjcloses):
+            raise ValueError(f"spark payload for {ticker} lacks full OHLCV/adjclose arrays")
+        for i, ts in enumerate(timestamps):
+            close_val = closes[i] if i < len(closes) else None
+            adj_val = adjcloses[i] if i < len(adjcloses) else None
+            if close_val is None or adj_val is None or not close_val:
+                continue
+            ratio = adj_val / close_val
+            open_val = opens[i] if i < len(opens) else None
+            high_val = highs[i] if i < len(highs) else None
+            low_val = lows[i] if i < len(lows) else None
+            rows.append({
+                "ticker": ticker,
+                "date": datetime.fromtimestamp(ts, tz=timezone.utc).date(),
+                "open": open_val * ratio if open_val is not None else None,
+                "high": high_val * ratio if high_val is not None else None,
+                "low": low_val * ratio if low_val is not None else None,
+                "close": adj_val,
+                "volume": volumes[i] if i < len(volumes) else None,
+            })
     return rows
 
 
+def _reshape_yfinance_long(raw):
+    """
+    Reshape a yfinance (Price, Ticker) MultiIndex DataFrame into long format
+    matching the daily_prices schema — one stack() instead of per-ticker
+    slicing and row-dict construction.
+    """
+    if raw is None or raw.empty:
+        return pd.DataFrame()
+    long = raw.stack(level=1, future_stack=True).reset_index()
+    long = long.rename(columns={
+        long.columns[0]: "date",
+        long.columns[1]: "ticker",
+        "Open": "open",
+        "High": "high",
+        "Low": "low",
+        "Close": "close",
+        "Volume": "volume",
+    })
+    if "close" not in long.columns:
+        return pd.DataFrame()
+    long = long.dropna(subset=["close"])
+    # ISO strings match how the sqlite dialect stores the Date column
+    long["date"] = pd.to_datetime(long["date"]).dt.strftime("%Y-%m-%d")
+    long["volume"] = long["volume"].astype("Int64")
+    return long[["ticker", "date", "open", "high", "low", "close", "volume"]]
+
+
+def _download_batch_yfinance(batch):
+    """Fallback path: download a batch via yfinance, reshaped to long format."""
+    raw = yf.download(
+        tickers=batch,
+        period="5y",
+        interval="1d",
+        auto_adjust=True,
+        progress=False,
+    )
+    return _reshape_yfinance_long(raw)
+
+
+def _insert_prices_dataframe(engine, df):
+    """
+    Write a long-format price DataFrame straight to SQLite: stage it with
+    to_sql (multi-row inserts, no Python row dicts), then merge with a
+    single INSERT OR IGNORE ... SELECT.
+    """
+    # 100-row chunks keep multi-row inserts under the 999-variable limit
+    df.to_sql("daily_prices_stage", engine, if_exists="replace", index=False,
+              method="multi", chunksize=100)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT OR IGNORE INTO daily_prices "
+            "(ticker, date, open, high, low, close, volume) "
+            "SELECT ticker, date, open, high, low, close, volume "
+            "FROM daily_prices_stage"
+        )
+        conn.exec_driver_sql("DROP TABLE daily_prices_stage")
+
+
+def _download_batch(http, batch, batch_num):
+    """Download one batch of tickers (spark first, yfinance as fallback)."""
+    _throttle()
+    try:
+        return _download_batch_spark(http, batch)
+    except Exception as e:
+        print(f"  [WARN] Batch {batch_num} spark download error: {e}; falling back to yfinance")
+        _throttle()
+        return _download_batch_yfinance(batch)
+
+
 def download_and_store_prices(session, tickers):
     engine = get_engine()
+    http = _make_http_session()
     total = len(tickers)
     print(f"\nDownloading 5-year daily prices for {total} tickers (batch size={BATCH_SIZE})...")
 
     batches = [tickers[i: i + BATCH_SIZE] for i in range(0, total, BATCH_SIZE)]
 
-    for batch_num, batch in enumerate(tqdm(batches, desc="Batches"), start=1):
-        try:
-            raw = yf.download(
-                tickers=batch,
-                period="5y",
-                interval="1d",
-                auto_adjust=True,
-                progress=False,
-            )
-        except Exception as e:
-            print(f"  [WARN] Batch {batch_num} download error: {e}")
-            time.sleep(2)
-            continue
-
-        rows = []
-        for ticker in batch:
-            rows.extend(_extract_ticker_rows(raw, ticker))
-
-        if rows:
-            # SQLite has a 999-variable limit; with 7 columns per row
-            # that allows max ~142 rows per INSERT. Use 100 to be safe.
-            INSERT_CHUNK = 100
-            for chunk_start in range(0, len(rows), INSERT_CHUNK):
-                chunk = rows[chunk_start: chunk_start + INSERT_CHUNK]
-                try:
-                    stmt = sqlite_insert(DailyPrice).values(chunk).on_conflict_do_nothing(
-                        index_elements=["ticker", "date"]
+    # Download batches in parallel; the SQLite inserts below stay on the main
+    # thread since SQLite only supports a single writer.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(_download_batch, http, batch, batch_num): batch_num
+            for batch_num, batch in enumerate(batches, start=1)
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Batches"):
+            batch_num = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"  [WARN] Batch {batch_num} download error: {e}")
+                continue
+
+            if isinstance(result, pd.DataFrame):
+                # yfinance fallback: stage the DataFrame and merge in SQL,
+                # never materializing per-row Python objects
+                if not result.empty:
+                    try:
+                        _insert_prices_dataframe(engine, result)
+                    except Exception as db_err:
+                        print(f"  [WARN] DB insert error in batch {batch_num}: {db_err}")
+                continue
+
+            rows = result
+            if rows:
+                # Prepared-statement executemany on the raw driver: one
+                # compiled statement per batch instead of a giant VALUES
+                # clause, and no 999-variable limit to chunk around. Dates
+                # are bound as ISO strings, matching how the sqlite dialect
+                # stores the Date column.
+                payload = [
+                    (
+                        r["ticker"],
+                        r["date"].isoformat(),
+                        r["open"],
+                        r["high"],
+                        r["low"],
+                        r["close"],
+                        r["volume"],
                     )
+                    for r in rows
+                ]
+                try:
                     with engine.begin() as conn:
-                        conn.execute(stmt)
+                        conn.exec_driver_sql(
+                            "INSERT OR IGNORE INTO daily_prices "
+                            "(ticker, date, open, high, low, close, volume) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            payload,
+                        )
                 except Exception as db_err:
                     print(f"  [WARN] DB insert error in batch {batch_num}: {db_err}")
 
-        # Polite delay to avoid rate limiting
-        time.sleep(0.5)
-
     print("\nPrice data download complete.")
 
 
+# ---------------------------------------------------------------------------
+# 4. Export per-ticker Parquet files for the API read path
+# ---------------------------------------------------------------------------
+
+def export_parquet(engine, tickers):
+    """
+    Write one zstd-compressed Parquet file per ticker from the SQLite data.
+    The /prices endpoint memory-maps these for columnar reads; SQLite stays
+    the source of truth (and read fallback), so re-exports are idempotent.
+    """
+    print(f"\nExporting per-ticker Parquet files to {PRICES_DIR}...")
+    os.makedirs(PRICES_DIR, exist_ok=True)
+    with engine.connect() as conn:
+        for ticker in tqdm(tickers, desc="Parquet"):
+            rows = conn.exec_driver_sql(
+                "SELECT date, open, high, low, close, volume "
+                "FROM daily_prices WHERE ticker = ? ORDER BY date",
+                (ticker,),
+            ).all()
+            if not rows:
+                continue
+            dates, opens, highs, lows, closes, volumes = zip(*rows)
+            # float32/int32 halve the file size versus 64-bit types; ~1e-7
+            # relative price precision is far below anything the chart shows
+            table = pa.table({
+                "date": pa.array(dates, type=pa.string()),
+                "open": pa.array(opens, type=pa.float32()),
+                "high": pa.array(highs, type=pa.float32()),
+                "low": pa.array(lows, type=pa.float32()),
+                "close": pa.array(closes, type=pa.float32()),
+                "volume": pa.array(volumes, type=pa.int32()),
+            })
+            pq.write_table(
+                table,
+                os.path.join(PRICES_DIR, f"{ticker}.parquet"),
+                compression="zstd",
+            )
+    print("Parquet export complete.")
+
+
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 
 def main():
+    parser = argparse.ArgumentParser(description="Download S&P 500 price history into SQLite.")
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Clear the HTTP response cache and re-download everything",
+    )
+    args = parser.parse_args()
+    if args.refresh:
+        requests_cache.clear()
+
     print("=" * 60)
     print("  S&P 500 Data Fetcher")
     print("=" * 60)
@@ -188,12 +429,19 @@ def main():
         stocks = get_sp500_list()
 
         # Step 2: Insert stocks
-        upsert_stocks(session, stocks)
+        upsert_stocks(get_engine(), stocks)
 
         # Step 3: Download and store prices
         tickers = [s["ticker"] for s in stocks]
         download_and_store_prices(session, tickers)
 
+        # Refresh planner statistics so queries use the (ticker, date) index
+        with get_engine().begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+
+        # Step 4: Export columnar files for the API
+        export_parquet(get_engine(), tickers)
+
         # Summary
         price_count = session.query(DailyPrice).count()
         stock_count = session.query(Stock).count()
@@ -1,13 +1,17 @@
-from sqlalchemy import Column, String, Float, Date, Integer, BigInteger, UniqueConstraint
+from sqlalchemy import Column, String, Float, Date, Integer, UniqueConstraint
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 import os
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "stock_data.db")
 DATABASE_URL = f"sqlite:///{DB_PATH}"
 
+# Columnar per-ticker OHLCV files written by fetch_data.py and read by the
+# /prices endpoint; SQLite remains the source of truth and fallback.
+PRICES_DIR = os.path.join(BASE_DIR, "data", "prices")
+
 Base = declarative_base()
 
 
@@ -32,19 +36,26 @@ class DailyPrice(Base):
     __tablename__ = "daily_prices"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    ticker = Column(String, index=True, nullable=False)
+    # The (ticker, date) UniqueConstraint below is backed by a composite
+    # index in SQLite, so `WHERE ticker=? AND date>=? ORDER BY date` is a
+    # single index range scan with no sort — a separate ticker index would
+    # be redundant. The date index stays for the global MAX(date) in
+    # /api/stats.
+    ticker = Column(String, nullable=False)
     date = Column(Date, index=True, nullable=False)
     open = Column(Float)
     high = Column(Float)
     low = Column(Float)
     close = Column(Float)
-    volume = Column(BigInteger)
+    # int32 range is plenty: the heaviest S&P 500 sessions trade <1B shares
+    volume = Column(Integer)
 
     __table_args__ = (UniqueConstraint("ticker", "date", name="uq_ticker_date"),)
 
     def to_dict(self):
+        # `date` is left as a datetime.date — orjson serializes it natively
         return {
-            "date": self.date.isoformat(),
+            "date": self.date,
             "open": self.open,
             "high": self.high,
             "low": self.low,
@@ -53,17 +64,84 @@ class DailyPrice(Base):
         }
 
 
+# Single module-level engine shared by the whole process — creating one per
+# request re-parses the URL, allocates a fresh pool and reopens the DB file.
+# check_same_thread=False lets pooled connections move between threads
+# (Flask request handlers, fetch_data worker threads).
+_engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    connect_args={"check_same_thread": False},
+    pool_pre_ping=True,
+)
+@event.listens_for(_engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    """
+    Tune SQLite on every new connection:
+      - WAL journal: readers don't block the writer (and vice versa), and
+        bulk inserts avoid a full fsync per transaction
+      - synchronous=NORMAL: safe with WAL, much faster than FULL
+      - 64 MB page cache, in-memory temp tables, 256 MB mmap window
+    """
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+
+_SessionFactory = sessionmaker(bind=_engine)
+SessionLocal = scoped_session(_SessionFactory)
+
+
 def get_engine():
-    return create_engine(DATABASE_URL, echo=False)
+    return _engine
 
 
 def get_session():
-    engine = get_engine()
-    Session = sessionmaker(bind=engine)
-    return Session()
+    return SessionLocal()
+
+
+# Full-text search over stocks. An external-content FTS5 table stays O(log N)
+# as the universe grows beyond the S&P 500; triggers keep it in sync with
+# `stocks`, and the 'rebuild' command repopulates it from existing rows.
+_FTS_SETUP_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS stocks_fts USING fts5(
+        ticker, name, sector,
+        content='stocks', content_rowid='rowid',
+        tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stocks_fts_ai AFTER INSERT ON stocks BEGIN
+        INSERT INTO stocks_fts(rowid, ticker, name, sector)
+        VALUES (new.rowid, new.ticker, new.name, new.sector);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stocks_fts_ad AFTER DELETE ON stocks BEGIN
+        INSERT INTO stocks_fts(stocks_fts, rowid, ticker, name, sector)
+        VALUES ('delete', old.rowid, old.ticker, old.name, old.sector);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stocks_fts_au AFTER UPDATE ON stocks BEGIN
+        INSERT INTO stocks_fts(stocks_fts, rowid, ticker, name, sector)
+        VALUES ('delete', old.rowid, old.ticker, old.name, old.sector);
+        INSERT INTO stocks_fts(rowid, ticker, name, sector)
+        VALUES (new.rowid, new.ticker, new.name, new.sector);
+    END
+    """,
+    "INSERT INTO stocks_fts(stocks_fts) VALUES ('rebuild')",
+]
 
 
 def init_db():
-    engine = get_engine()
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(_engine)
+    with _engine.begin() as conn:
+        for stmt in _FTS_SETUP_SQL:
+            conn.exec_driver_sql(stmt)
     print(f"Database initialized at: {DB_PATH}")
@@ -187,9 +187,10 @@ function renderBanner(meta) {
 // ── Render chart ─────────────────────────────────────────────
 
 function renderChart(ticker, prices) {
-  const labels = prices.map((p) => p.date);
-  const closes = prices.map((p) => p.close);
-  const volumes = prices.map((p) => p.volume);
+  // Columnar payload: one array per field ({date: [...], close: [...], ...})
+  const labels = prices.date;
+  const closes = prices.close;
+  const volumes = prices.volume;
 
   // Summary stats
   const latestClose = closes[closes.length - 1];